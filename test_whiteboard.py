@@ -0,0 +1,251 @@
+import asyncio
+import io
+import json
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image, ImageDraw
+
+import whiteboard
+from whiteboard import _NUMPY_AVAILABLE, _catmull_rom, _JsonObjectScanner, WhiteboardApp
+
+
+def _make_board(size=(100, 80)) -> WhiteboardApp:
+    """A WhiteboardApp with just the backing-image state, so it needs no display."""
+    app = WhiteboardApp.__new__(WhiteboardApp)
+    app.background_color = "#FFFFFF"
+    app._backing = Image.new("RGB", size, app.background_color)
+    app._backing_draw = ImageDraw.Draw(app._backing)
+    app._refresh_backing = lambda box=None: None
+    app.undo_stack = []
+    app.redo_stack = []
+    app._undo_crop_bytes = 0
+    app._undo_cropless = 0
+    return app
+
+
+def _line(tag, *coords, width=4):
+    return tag, [("create_line", coords, {"fill": "#000000", "width": width, "capstyle": "round"})]
+
+
+def test_scanner_ignores_braces_inside_strings() -> None:
+    text = '{"critique": "add a } and a { here", "label": "cat"}'
+    assert _JsonObjectScanner().feed(text) == [text]
+
+
+def test_scanner_handles_escaped_quotes() -> None:
+    text = r'{"critique": "say \"}\" twice\\", "label": "dog"}'
+    found = _JsonObjectScanner().feed(text)
+    assert found == [text]
+    assert json.loads(found[0])["label"] == "dog"
+
+
+def test_scanner_joins_an_object_split_across_feeds() -> None:
+    scanner = _JsonObjectScanner()
+    assert scanner.feed('Here you go: {"label": "ca') == []
+    assert scanner.feed('t", "note": "a \\') == []
+    assert scanner.feed('"{"}') == ['{"label": "cat", "note": "a \\"{"}']
+
+
+def test_scanner_skips_text_between_objects() -> None:
+    scanner = _JsonObjectScanner()
+    found = scanner.feed('```json\n{"a": 1}\n```\nand then {"b": {"c": 2}} done')
+    assert found == ['{"a": 1}', '{"b": {"c": 2}}']
+
+
+def test_scanner_ignores_text_past_the_limit() -> None:
+    scanner = _JsonObjectScanner(limit=12)
+    assert scanner.feed('{"a": 1} {"b": 2}') == ['{"a": 1}']
+    assert scanner.feed('{"c": 3}') == []
+
+
+def test_undo_restores_pixels_and_redo_redraws_them() -> None:
+    app = _make_board()
+    blank = app._backing.tobytes()
+    app._commit_stroke(_line("stroke_1", 10, 10, 60, 40))
+    drawn = app._backing.tobytes()
+    assert drawn != blank
+
+    app.undo()
+    assert app._backing.tobytes() == blank
+    assert app.undo_stack == []
+    app.redo()
+    assert app._backing.tobytes() == drawn
+    assert app.redo_stack == []
+
+
+def test_undo_restores_overlapping_strokes_in_order() -> None:
+    app = _make_board()
+    states = [app._backing.tobytes()]
+    for i, coords in enumerate([(10, 10, 90, 70), (10, 70, 90, 10), (50, 0, 50, 80)]):
+        app._commit_stroke(_line(f"stroke_{i}", *coords))
+        states.append(app._backing.tobytes())
+    for state in reversed(states[:-1]):
+        app.undo()
+        assert app._backing.tobytes() == state
+
+
+def test_stroke_bbox_is_clamped_to_the_backing_image() -> None:
+    app = _make_board()
+    _, spec = _line("stroke_1", -50, 20, 150, 200)
+    # Padded by the width plus 2, then clipped at the image edges
+    assert app._stroke_bbox(spec) == (0, 14, 100, 80)
+    _, spec = _line("stroke_2", 200, 200, 300, 300)
+    left, top, right, bottom = app._stroke_bbox(spec)
+    assert right == left and bottom == top
+
+
+def test_undo_of_a_stroke_partly_outside_the_canvas() -> None:
+    app = _make_board()
+    blank = app._backing.tobytes()
+    app._commit_stroke(_line("stroke_1", -30, 40, 130, 40))
+    app._commit_stroke(_line("stroke_2", 500, 500, 600, 600))
+    app.undo()
+    app.undo()
+    assert app._backing.tobytes() == blank
+
+
+def test_undo_past_the_crop_budget_redraws_the_remaining_strokes(monkeypatch) -> None:
+    monkeypatch.setattr(whiteboard, "_UNDO_CROP_BUDGET", 20000)
+    app = _make_board()
+    states = [app._backing.tobytes()]
+    for i, coords in enumerate([(10, 10, 90, 70), (10, 70, 90, 10), (50, 0, 50, 80), (0, 40, 100, 40)]):
+        app._commit_stroke(_line(f"stroke_{i}", *coords))
+        states.append(app._backing.tobytes())
+        assert app._undo_crop_bytes <= whiteboard._UNDO_CROP_BUDGET
+
+    assert app._undo_cropless > 0
+    assert all(before is None for _, _, before in app.undo_stack[:app._undo_cropless])
+    for state in reversed(states[:-1]):
+        app.undo()
+        assert app._backing.tobytes() == state
+    assert app._undo_crop_bytes == 0
+
+
+class _FakeCanvas:
+    """Records the coordinates of the line items created on it."""
+
+    def __init__(self) -> None:
+        self.lines = []
+
+    def create_line(self, *coords, **kwargs) -> int:
+        self.lines.append(list(coords))
+        return len(self.lines)
+
+
+def _start_pen_stroke(x: int, y: int) -> WhiteboardApp:
+    app = WhiteboardApp.__new__(WhiteboardApp)
+    app.canvas = _FakeCanvas()
+    app._stroke_kwargs = {}
+    app._pending_points = [x, y]
+    app._frozen_line_ids = []
+    app._spline_points = []
+    app._spline_segments = 0
+    app._frozen_upto = 0
+    return app
+
+
+@pytest.mark.skipif(not _NUMPY_AVAILABLE, reason="needs numpy")
+def test_catmull_rom_preserves_endpoints() -> None:
+    points = [0, 0, 10, 5, 20, -5, 30, 0]
+    curve = _catmull_rom(points)
+    assert curve[:2] == [0, 0]
+    assert curve[-2:] == [30, 0]
+    # Two samples per segment plus the final point
+    assert len(curve) == 2 * (2 * 3 + 1)
+
+
+@pytest.mark.skipif(not _NUMPY_AVAILABLE, reason="needs numpy")
+@pytest.mark.parametrize("points_per_tick", [1, 3, 7])
+def test_frozen_runs_and_live_tail_match_the_whole_stroke_spline(points_per_tick) -> None:
+    xs = list(range(0, 400, 5))
+    points = [v for x in xs for v in (x, (x * 37) % 101)]
+    app = _start_pen_stroke(*points[:2])
+    for i in range(2, len(points), 2 * points_per_tick):
+        app._pending_points.extend(points[i:i + 2 * points_per_tick])
+        tail = app._live_spline_tail()
+
+        # Consecutive items share their joining point; drop the repeat
+        shown = []
+        for line in app.canvas.lines:
+            shown.extend(line[:-2])
+        shown.extend(tail)
+        assert shown == pytest.approx(_catmull_rom(app._pending_points), abs=1e-3)
+
+    assert app.canvas.lines, "a long stroke should have frozen runs"
+    assert len(tail) < 8 * whiteboard._LIVE_TAIL_POINTS
+
+
+class _FakeGeminiModel:
+    """Streams a canned reply in small chunks, like generate_content_async(stream=True)."""
+
+    def __init__(self, reply: str) -> None:
+        self.reply = reply
+        self.requests = []
+
+    async def generate_content_async(self, contents, stream=False):
+        self.requests.append(contents)
+
+        async def chunks():
+            for i in range(0, len(self.reply), 7):
+                yield SimpleNamespace(text=self.reply[i:i + 7])
+        return chunks()
+
+
+def _make_analysis_app(reply: str) -> WhiteboardApp:
+    app = WhiteboardApp.__new__(WhiteboardApp)
+    app._gemini_model = _FakeGeminiModel(reply)
+    app._gemini_model_name = "test-model"
+    app._analysis_semaphore = asyncio.Semaphore(whiteboard._MAX_CONCURRENT_ANALYSES)
+    app._analysis_cache = OrderedDict()
+    app._analysis_queue = []
+    app._analysis_flush_scheduled = False
+    app._encode_buf = io.BytesIO()
+    app._encode_lock = threading.Lock()
+    app.after = lambda ms, func: None
+    return app
+
+
+def test_batched_drawings_go_out_as_one_gemini_request(monkeypatch) -> None:
+    reply = (
+        'Sure! ```json\n{"label": "cat", "confidence": 90, "critique": "Nice {ears}."}\n'
+        '{"label": "house", "confidence": 75, "critique": "Add a door."}```'
+    )
+    app = _make_analysis_app(reply)
+    runs = []
+    app._run_analysis = lambda coro, cache_keys: runs.append((coro, cache_keys))
+    cat, house = Image.new("RGB", (8, 8), "white"), Image.new("RGB", (8, 8), "black")
+
+    for img in (cat, house, cat.copy()):
+        app._queue_analysis("gemini", "test-model", img)
+    app._flush_analysis_queue()
+
+    # The repeated capture is sent once, and both drawings share one request
+    assert len(runs) == 1
+    coro, cache_keys = runs[0]
+    assert len(cache_keys) == 2
+    results = asyncio.run(coro)
+    prompt, *image_parts = app._gemini_model.requests[0]
+    assert len(image_parts) == 2 and "2 JSON objects" in prompt
+    assert results == [
+        ("Label: cat\nConfidence: 90\n\nNice {ears}.", True),
+        ("Label: house\nConfidence: 75\n\nAdd a door.", True),
+    ]
+
+    shown = []
+    monkeypatch.setattr(whiteboard.messagebox, "showinfo", lambda title, message: shown.append(message))
+    app._show_analyses(cache_keys, results)
+    assert shown[0].startswith("Drawing 1:\nLabel: cat") and "\n\nDrawing 2:\nLabel: house" in shown[0]
+    assert list(app._analysis_cache) == cache_keys
+
+
+def test_gemini_objects_without_a_label_are_not_cached() -> None:
+    reply = '{"label": "cat", "confidence": 90} {"error": "could not judge"}'
+    app = _make_analysis_app(reply)
+    imgs = [Image.new("RGB", (8, 8), "white"), Image.new("RGB", (8, 8), "black")]
+
+    results = asyncio.run(app._analyze_with_gemini(imgs))
+    assert results[0] == ("Label: cat\nConfidence: 90\n\n", True)
+    assert results[1] == (reply, False)
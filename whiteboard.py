@@ -1,21 +1,33 @@
-from typing import List, Optional
+from typing import Any, Coroutine, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
 import os
 import io
 import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
-import re
+from collections import OrderedDict
 
 import tkinter as tk
 from tkinter import ttk, colorchooser, filedialog, messagebox
 
 try:
-    from PIL import ImageGrab
+    from PIL import Image, ImageDraw, ImageTk
 except ImportError as exc:
     raise SystemExit(
         "Pillow is required. Install with: pip install Pillow"
     ) from exc
 
+try:
+    import numpy as np
+    _NUMPY_AVAILABLE = True
+except ImportError:
+    _NUMPY_AVAILABLE = False
+
 # Load .env if present (for GEMINI_API_KEY, HF_API_TOKEN, etc.)
 try:
     from dotenv import load_dotenv  # type: ignore
@@ -24,10 +36,148 @@ except Exception:
     pass
 try:
     import google.generativeai as genai  # type: ignore
+    from google.api_core import exceptions as google_exceptions  # type: ignore
     _GEMINI_AVAILABLE = True
 except Exception:
     _GEMINI_AVAILABLE = False
 
+# Largest image sent to Gemini, and the input size of the default HF classifier
+_AI_MAX_IMAGE_SIZE = (1024, 1024)
+_HF_INPUT_SIZE = (224, 224)
+
+# Gemini quota errors are retried with exponential backoff (10s, 20s, 40s, ...)
+_GEMINI_MAX_ATTEMPTS = 6
+_GEMINI_BACKOFF_SECONDS = 10
+
+# Only this much of a Gemini response is searched for the JSON result
+_JSON_SCAN_LIMIT = 64 * 1024
+
+# Upper bound on AI requests in flight at once
+_MAX_CONCURRENT_ANALYSES = 5
+
+# Recent analysis results, keyed by (provider, model name, image digest)
+_ANALYSIS_CACHE_SIZE = 32
+AnalysisCacheKey = Tuple[str, str, bytes]
+# An analysis message and whether it parsed into a label and confidence; only
+# those are cached, so errors and fallbacks are retried on the next click
+AnalysisResult = Tuple[str, bool]
+
+# Analyze clicks this close together are sent as one batch
+_ANALYSIS_BATCH_WINDOW_MS = 100
+
+_HF_LOADING_MESSAGE = "Model is loading on Hugging Face. Please try again in a few seconds."
+
+# With NumPy, pen strokes are spline-smoothed in Python rather than by Tk
+# (which re-smooths the whole line on every update). The live stroke is split
+# into finished runs of this many input points plus a short tail, so each
+# tick only re-splines and re-sends the tail.
+_LIVE_TAIL_POINTS = 16
+
+# Canvas create_* method and color option for each shape drawing mode
+_SHAPE_METHODS = {"line": "create_line", "rectangle": "create_rectangle", "circle": "create_oval"}
+_SHAPE_COLOR_OPTION = {"line": "fill", "rectangle": "outline", "circle": "outline"}
+
+# (canvas method name, coords, options) for one create_* call
+ItemSpec = Tuple[str, Tuple[float, ...], Dict[str, object]]
+# (stroke tag, the create_* calls that make up the stroke)
+StrokeRecord = Tuple[str, List[ItemSpec]]
+# (left, top, right, bottom) pixel box in backing-image coordinates
+Box = Tuple[int, int, int, int]
+# A committed stroke plus the backing pixels under it before it was drawn;
+# None once those pixels were dropped to stay within _UNDO_CROP_BUDGET
+UndoEntry = Tuple[StrokeRecord, Box, Optional[Image.Image]]
+
+# Bytes of pre-stroke pixels kept for undo. Past this the oldest crops are
+# dropped, and undoing those strokes redraws the remaining ones instead.
+_UNDO_CROP_BUDGET = 64 * 1024 * 1024
+
+
+def _catmull_rom_segments(control: "np.ndarray", samples: int) -> "np.ndarray":
+    """Samples the Catmull-Rom segments between control[1] and control[-2].
+
+    `control` is an (m + 3, 2) array of control points; the result is an
+    (m * samples, 2) array starting at control[1] and stopping short of control[-2].
+    """
+    m = len(control) - 3
+    p0, p1, p2, p3 = (control[i:i + m, None, :] for i in range(4))
+    t = np.linspace(0.0, 1.0, samples, endpoint=False, dtype=np.float32)[None, :, None]
+    curve = 0.5 * (
+        2 * p1
+        + (p2 - p0) * t
+        + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t ** 2
+        + (3 * p1 - p0 - 3 * p2 + p3) * t ** 3
+    )
+    return curve.reshape(-1, 2)
+
+
+def _catmull_rom(points: Sequence[float], samples: int = 2) -> List[float]:
+    """Resamples a flat [x0, y0, x1, y1, ...] polyline along a Catmull-Rom spline.
+
+    Every segment is sampled `samples` times, so the result has about that many
+    times as many vertices; the curve passes through all of the input points.
+    """
+    p = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+    ext = np.concatenate((p[:1], p, p[-1:]))
+    return np.concatenate((_catmull_rom_segments(ext, samples), p[-1:])).ravel().tolist()
+
+
+class _JsonObjectScanner:
+    """Finds complete top-level {...} objects in text fed to it piece by piece.
+
+    A single linear pass that tracks brace depth and skips braces inside JSON
+    strings, so it can run on a streamed response without re-scanning it. Text
+    beyond `limit` characters is ignored.
+    """
+
+    def __init__(self, limit: int = _JSON_SCAN_LIMIT) -> None:
+        self._remaining = limit
+        self._parts: List[str] = []  # pieces of the object currently open
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text: str) -> List[str]:
+        """Consumes text and returns the objects completed within it."""
+        text = text[:self._remaining]
+        self._remaining -= len(text)
+        found: List[str] = []
+        start = 0  # where the open object begins within this piece of text
+        i = 0
+        n = len(text)
+        while i < n:
+            if self._depth == 0:
+                # Outside any object only an opening brace matters
+                start = text.find("{", i)
+                if start < 0:
+                    return found
+                self._depth = 1
+                i = start + 1
+                continue
+
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(text[start:i + 1])
+                    found.append("".join(self._parts))
+                    self._parts = []
+            i += 1
+
+        if self._depth > 0:
+            self._parts.append(text[start:])
+        return found
+
 
 class WhiteboardApp(tk.Tk):
     """A simple whiteboard application with drawing, eraser, undo/redo, and save-as-PNG."""
@@ -46,16 +196,81 @@ class WhiteboardApp(tk.Tk):
         self.is_eraser: bool = False
         self.draw_mode: str = "pen"  # "pen", "rectangle", "circle", "line"
 
-        # Stroke management: tag each stroke so we can hide/show for undo/redo
+        # Stroke management: undo restores the pixels a stroke covered; redo
+        # re-rasterizes the stroke from the create_* calls that drew it
         self.stroke_index: int = 0
         self.current_stroke_tag: Optional[str] = None
-        self._current_stroke_has_items: bool = False
-        self.undo_stack: List[str] = []  # list of stroke tags
-        self.redo_stack: List[str] = []  # list of stroke tags
+        self._current_stroke_spec: List[ItemSpec] = []
+        self.undo_stack: List[UndoEntry] = []
+        self.redo_stack: List[StrokeRecord] = []
+        self._undo_crop_bytes: int = 0
+        self._undo_cropless: int = 0  # the oldest entries, whose crops were dropped
 
         self._last_x: Optional[int] = None
         self._last_y: Optional[int] = None
-        self._preview_item = None
+        self._preview_item: Optional[int] = None
+        self._preview_kind: Optional[str] = None
+        self._preview_style: Optional[Tuple[str, int]] = None
+
+        # Pen strokes are drawn as one live multi-point line item per stroke; with
+        # NumPy, finished runs of the spline are moved to their own items
+        self._pending_points: List[int] = []
+        self._pending_line_id: Optional[int] = None
+        self._frozen_line_ids: List[int] = []
+        self._spline_points: List[float] = []  # spline of the segments that can no longer change
+        self._spline_segments: int = 0
+        self._frozen_upto: int = 0  # index into _spline_points where the live tail starts
+
+        # Stroke style resolved once per stroke rather than per motion event
+        self._stroke_color: str = self.current_color
+        self._stroke_kwargs: Dict[str, object] = {}
+
+        # Brush size changes from the scale are debounced
+        self._pending_brush_size: str = str(self.brush_size)
+        self._brush_size_scheduled: bool = False
+
+        # Motion events are coalesced and rendered at most once per frame
+        self._dirty: bool = False
+        self._flush_scheduled: bool = False
+        self._latest_xy: Optional[Tuple[int, int]] = None
+
+        # Reused HTTP session so repeat HF calls skip the TLS handshake; the
+        # adapter retries transient gateway errors (e.g. model cold start)
+        self._hf_session = requests.Session()
+        self._hf_session.mount("https://", HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=_MAX_CONCURRENT_ANALYSES,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=1.0,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=None,
+                raise_on_status=False,
+            ),
+        ))
+
+        # AI analyses run as coroutines on one background event loop
+        self._loop = asyncio.new_event_loop()
+        self._analysis_semaphore = asyncio.Semaphore(_MAX_CONCURRENT_ANALYSES)
+        self._pending_analyses: int = 0
+        self._analysis_cache: "OrderedDict[AnalysisCacheKey, str]" = OrderedDict()
+        self._analysis_queue: List[Tuple[AnalysisCacheKey, Image.Image]] = []
+        self._analysis_flush_scheduled: bool = False
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+
+        # Upload encodes reuse one buffer instead of allocating one per call
+        self._encode_buf = io.BytesIO()
+        self._encode_lock = threading.Lock()
+
+        # Configure Gemini once and open its connection in the background so
+        # the first Analyze click doesn't pay for client setup
+        self._gemini_model = None
+        self._gemini_model_name: str = os.environ.get("GEMINI_MODEL", "gemini-1.5-flash")
+        gemini_key = os.environ.get("GEMINI_API_KEY")
+        if gemini_key and _GEMINI_AVAILABLE:
+            genai.configure(api_key=gemini_key)
+            self._gemini_model = genai.GenerativeModel(self._gemini_model_name)
+            asyncio.run_coroutine_threadsafe(self._warm_up_gemini(), self._loop)
 
         self._build_ui()
         self._bind_shortcuts()
@@ -67,58 +282,60 @@ class WhiteboardApp(tk.Tk):
         self.rowconfigure(0, weight=1)
 
         toolbar = ttk.Frame(self, padding=(10, 10))
-        toolbar.grid(row=0, column=0, sticky="ns")
         toolbar.columnconfigure(0, weight=1)
 
-        # Buttons and controls
-        color_btn = ttk.Button(toolbar, text="Color", command=self.choose_color)
-        color_btn.grid(row=0, column=0, sticky="ew", pady=(0, 6))
-
+        # Buttons and controls, listed top to bottom with their grid options;
+        # they are gridded in one pass below and the toolbar is shown last
         self.eraser_var = tk.BooleanVar(value=self.is_eraser)
-        eraser_btn = ttk.Checkbutton(
-            toolbar, text="Eraser", variable=self.eraser_var, command=self.toggle_eraser
-        )
-        eraser_btn.grid(row=1, column=0, sticky="ew", pady=6)
-
-        # Shape tools
-        ttk.Label(toolbar, text="Tools").grid(row=2, column=0, sticky="w")
         self.mode_var = tk.StringVar(value="pen")
-        ttk.Radiobutton(toolbar, text="Pen", variable=self.mode_var, value="pen", command=self._set_mode).grid(row=3, column=0, sticky="w")
-        ttk.Radiobutton(toolbar, text="Line", variable=self.mode_var, value="line", command=self._set_mode).grid(row=4, column=0, sticky="w")
-        ttk.Radiobutton(toolbar, text="Rectangle", variable=self.mode_var, value="rectangle", command=self._set_mode).grid(row=5, column=0, sticky="w")
-        ttk.Radiobutton(toolbar, text="Circle", variable=self.mode_var, value="circle", command=self._set_mode).grid(row=6, column=0, sticky="w")
-
-        ttk.Label(toolbar, text="Brush size").grid(row=7, column=0, sticky="w")
-        self.size_scale = ttk.Scale(
-            toolbar, from_=1, to=30, value=self.brush_size, orient=tk.HORIZONTAL, command=self._on_size_change
-        )
-        self.size_scale.grid(row=8, column=0, sticky="ew", pady=(0, 6))
-
-        undo_btn = ttk.Button(toolbar, text="Undo (Ctrl+Z)", command=self.undo)
-        undo_btn.grid(row=9, column=0, sticky="ew", pady=(6, 0))
-
-        redo_btn = ttk.Button(toolbar, text="Redo (Ctrl+Y)", command=self.redo)
-        redo_btn.grid(row=10, column=0, sticky="ew", pady=(6, 0))
-
-        clear_btn = ttk.Button(toolbar, text="Clear", command=self.clear_canvas)
-        clear_btn.grid(row=11, column=0, sticky="ew", pady=(12, 0))
-
-        save_btn = ttk.Button(toolbar, text="Save PNG (Ctrl+S)", command=self.save_png)
-        save_btn.grid(row=12, column=0, sticky="ew", pady=(6, 0))
-
-        analyze_btn = ttk.Button(toolbar, text="Analyze (AI)", command=self.analyze_drawing)
-        analyze_btn.grid(row=13, column=0, sticky="ew", pady=(12, 0))
-
-        ttk.Label(toolbar, text="Tips: Hold left mouse to draw").grid(row=14, column=0, sticky="w", pady=(12, 0))
+        controls: List[Tuple[tk.Widget, Dict[str, Any]]] = [
+            (ttk.Button(toolbar, text="Color", command=self.choose_color), dict(sticky="ew", pady=(0, 6))),
+            (ttk.Checkbutton(
+                toolbar, text="Eraser", variable=self.eraser_var, command=self.toggle_eraser
+            ), dict(sticky="ew", pady=6)),
+            # Shape tools
+            (ttk.Label(toolbar, text="Tools"), dict(sticky="w")),
+            (ttk.Radiobutton(toolbar, text="Pen", variable=self.mode_var, value="pen", command=self._set_mode), dict(sticky="w")),
+            (ttk.Radiobutton(toolbar, text="Line", variable=self.mode_var, value="line", command=self._set_mode), dict(sticky="w")),
+            (ttk.Radiobutton(toolbar, text="Rectangle", variable=self.mode_var, value="rectangle", command=self._set_mode), dict(sticky="w")),
+            (ttk.Radiobutton(toolbar, text="Circle", variable=self.mode_var, value="circle", command=self._set_mode), dict(sticky="w")),
+            (ttk.Label(toolbar, text="Brush size"), dict(sticky="w")),
+            # Created in place so it keeps its position in the Tab order
+            (size_scale := ttk.Scale(
+                toolbar, from_=1, to=30, value=self.brush_size, orient=tk.HORIZONTAL, command=self._on_size_change
+            ), dict(sticky="ew", pady=(0, 6))),
+            (ttk.Button(toolbar, text="Undo (Ctrl+Z)", command=self.undo), dict(sticky="ew", pady=(6, 0))),
+            (ttk.Button(toolbar, text="Redo (Ctrl+Y)", command=self.redo), dict(sticky="ew", pady=(6, 0))),
+            (ttk.Button(toolbar, text="Clear", command=self.clear_canvas), dict(sticky="ew", pady=(12, 0))),
+            (ttk.Button(toolbar, text="Save PNG (Ctrl+S)", command=self.save_png), dict(sticky="ew", pady=(6, 0))),
+            (ttk.Button(toolbar, text="Analyze (AI)", command=self.analyze_drawing), dict(sticky="ew", pady=(12, 0))),
+            (ttk.Label(toolbar, text="Tips: Hold left mouse to draw"), dict(sticky="w", pady=(12, 0))),
+        ]
+        self.size_scale = size_scale
+        for row, (widget, grid_opts) in enumerate(controls):
+            widget.grid(row=row, column=0, **grid_opts)
+        toolbar.grid(row=0, column=0, sticky="ns")
 
-        # Canvas
+        # Canvas: finished strokes live in a PIL backing image shown as a single
+        # image item; only the stroke being drawn exists as live canvas items
         self.canvas = tk.Canvas(self, bg=self.background_color, highlightthickness=0)
         self.canvas.grid(row=0, column=1, sticky="nsew")
 
+        # Start at the primary screen size; _on_canvas_resize grows it if the
+        # canvas ever gets larger (e.g. on a bigger secondary monitor)
+        self._backing = Image.new("RGB", (self.winfo_screenwidth(), self.winfo_screenheight()), self.background_color)
+        self._backing_draw = ImageDraw.Draw(self._backing)
+        self._backing_photo = ImageTk.PhotoImage(self._backing)
+        self._bg_item = self.canvas.create_image(0, 0, anchor="nw", image=self._backing_photo)
+
+        # Shape tools: the bound canvas method that draws each mode (see _SHAPE_METHODS)
+        self._shape_create = {mode: getattr(self.canvas, method) for mode, method in _SHAPE_METHODS.items()}
+
         # Mouse bindings
         self.canvas.bind("<ButtonPress-1>", self._start_draw)
         self.canvas.bind("<B1-Motion>", self._draw_motion)
         self.canvas.bind("<ButtonRelease-1>", self._end_draw)
+        self.canvas.bind("<Configure>", self._on_canvas_resize)
 
     def _bind_shortcuts(self) -> None:
         self.bind("<Control-z>", lambda e: self.undo())
@@ -130,10 +347,19 @@ class WhiteboardApp(tk.Tk):
         self.bind("e", lambda e: self._toggle_eraser_shortcut())
 
     def _on_size_change(self, value: str) -> None:
+        # The scale fires on every pixel of a drag; apply the latest value at most every 50ms
+        self._pending_brush_size = value
+        if not self._brush_size_scheduled:
+            self._brush_size_scheduled = True
+            self.after(50, self._apply_brush_size)
+
+    def _apply_brush_size(self) -> None:
+        self._brush_size_scheduled = False
         try:
-            self.brush_size = int(float(value))
+            self.brush_size = int(float(self._pending_brush_size))
         except ValueError:
-            pass
+            return
+        self._invalidate_stroke_style()
 
     def choose_color(self) -> None:
         color_tuple = colorchooser.askcolor(color=self.current_color, title="Choose draw color")
@@ -146,113 +372,303 @@ class WhiteboardApp(tk.Tk):
 
     def toggle_eraser(self) -> None:
         self.is_eraser = bool(self.eraser_var.get())
+        self._invalidate_stroke_style()
 
     def _toggle_eraser_shortcut(self) -> None:
         self.is_eraser = not self.is_eraser
         self.eraser_var.set(self.is_eraser)
+        self._invalidate_stroke_style()
 
     def _set_mode(self) -> None:
         self.draw_mode = self.mode_var.get()
 
     # --- Drawing logic ---
     def _start_draw(self, event: tk.Event) -> None:
-        self._current_stroke_has_items = False
+        self._current_stroke_spec = []
         self.current_stroke_tag = f"stroke_{self.stroke_index}"
         self.stroke_index += 1
         self._last_x, self._last_y = event.x, event.y
+        self._cache_stroke_style()
         
         if self.draw_mode == "pen":
-            color = self.background_color if self.is_eraser else self.current_color
-            self.canvas.create_line(
-                event.x, event.y, event.x + 1, event.y + 1,
-                fill=color, width=self.brush_size, capstyle=tk.ROUND,
-                smooth=True, tags=(self.current_stroke_tag,)
-            )
-            self._current_stroke_has_items = True
+            self._pending_points = [event.x, event.y]
+            self._pending_line_id = None
+            self._frozen_line_ids = []
+            self._spline_points = []
+            self._spline_segments = 0
+            self._frozen_upto = 0
+
+    def _cache_stroke_style(self) -> None:
+        """Resolves the color and pen options used for the current stroke."""
+        self._stroke_color = self.background_color if self.is_eraser else self.current_color
+        self._stroke_kwargs = dict(
+            fill=self._stroke_color, width=self.brush_size, capstyle=tk.ROUND,
+            # Tk's own smoothing is never used: PIL can't reproduce it, so the
+            # stroke would change shape when it is committed to the backing image
+            smooth=False, tags=(self.current_stroke_tag,)
+        )
+
+    def _invalidate_stroke_style(self) -> None:
+        """Re-resolves the stroke style after an eraser or brush size change mid-stroke."""
+        if self.current_stroke_tag is None:
+            return
+        self._cache_stroke_style()
+        for item_id in self._frozen_line_ids + [self._pending_line_id]:
+            if item_id is not None:
+                self.canvas.itemconfigure(item_id, fill=self._stroke_color, width=self.brush_size)
 
     def _draw_motion(self, event: tk.Event) -> None:
         if self._last_x is None or self._last_y is None:
             return
 
+        # Only record the event here; the canvas is updated at most once per
+        # frame by _flush_stroke so bursts of motion events coalesce.
         if self.draw_mode == "pen":
-            color = self.background_color if self.is_eraser else self.current_color
-            self.canvas.create_line(
-                self._last_x, self._last_y, event.x, event.y,
-                fill=color, width=self.brush_size, capstyle=tk.ROUND,
-                smooth=True, tags=(self.current_stroke_tag,)
-            )
-            self._last_x, self._last_y = event.x, event.y
+            self._pending_points.extend((event.x, event.y))
         else:
-            # Shape preview
-            if self._preview_item:
-                self.canvas.delete(self._preview_item)
-            color = self.background_color if self.is_eraser else self.current_color
-            if self.draw_mode == "line":
-                self._preview_item = self.canvas.create_line(
-                    self._last_x, self._last_y, event.x, event.y,
-                    fill=color, width=self.brush_size
-                )
-            elif self.draw_mode == "rectangle":
-                self._preview_item = self.canvas.create_rectangle(
-                    self._last_x, self._last_y, event.x, event.y,
-                    outline=color, width=self.brush_size
-                )
-            elif self.draw_mode == "circle":
-                self._preview_item = self.canvas.create_oval(
-                    self._last_x, self._last_y, event.x, event.y,
-                    outline=color, width=self.brush_size
-                )
+            self._latest_xy = (event.x, event.y)
+        self._dirty = True
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.after(16, self._flush_stroke)
+
+    def _flush_stroke(self) -> None:
+        """Applies the motion recorded since the last flush to the canvas."""
+        self._flush_scheduled = False
+        if not self._dirty or self._last_x is None or self._last_y is None:
+            return
+        self._dirty = False
+
+        if self.draw_mode == "pen":
+            coords = self._live_spline_tail() if _NUMPY_AVAILABLE else self._pending_points
+            if self._pending_line_id is None:
+                self._pending_line_id = self.canvas.create_line(*coords, **self._stroke_kwargs)
+            else:
+                self.canvas.coords(self._pending_line_id, *coords)
+        elif self._latest_xy is not None:
+            self._update_preview(*self._latest_xy)
+
+    def _live_spline_tail(self) -> List[float]:
+        """Extends the stroke's spline with the new points and returns the live tail.
+
+        Catmull-Rom segment i depends only on points i-1..i+2, so every segment
+        but the last is final once its points exist. Final segments are splined
+        once and cached; runs of them are handed to their own canvas items, and
+        only the remainder plus the last segment is returned for the live item.
+        The result matches _catmull_rom over the whole stroke.
+        """
+        pts = self._pending_points
+        n = len(pts) // 2
+        final = max(0, n - 2)
+        k = self._spline_segments
+        if final > k:
+            # Control points for segments k..final-1, padding the start with P0
+            control = pts[2 * (k - 1):2 * (final + 2)] if k else pts[:2] + pts[:2 * (final + 2)]
+            segments = _catmull_rom_segments(np.asarray(control, dtype=np.float32).reshape(-1, 2), 2)
+            self._spline_points.extend(segments.ravel().tolist())
+            self._spline_segments = final
+
+            if len(self._spline_points) - self._frozen_upto >= 4 * _LIVE_TAIL_POINTS:
+                self._frozen_line_ids.append(self.canvas.create_line(
+                    *self._spline_points[self._frozen_upto:], **self._stroke_kwargs
+                ))
+                # The next run starts at this run's last point so the line stays joined
+                self._frozen_upto = len(self._spline_points) - 2
+
+        # The last segment uses the final point twice and changes until the stroke ends
+        idx = (max(n - 3, 0), n - 2, n - 1, n - 1)
+        control = np.asarray([pts[2 * i:2 * i + 2] for i in idx], dtype=np.float32)
+        tail = _catmull_rom_segments(control, 2).ravel().tolist()
+        return self._spline_points[self._frozen_upto:] + tail + pts[-2:]
+
+    def _update_preview(self, x: int, y: int) -> None:
+        """Moves the shape preview to end at (x, y), creating it on first use."""
+        color = self._stroke_color
+        style = (color, self.brush_size)
+        color_key = _SHAPE_COLOR_OPTION[self.draw_mode]
+        if self._preview_item is not None and self._preview_kind == self.draw_mode:
+            self.canvas.coords(self._preview_item, self._last_x, self._last_y, x, y)
+            if style != self._preview_style:
+                self.canvas.itemconfigure(self._preview_item, **{color_key: color, "width": self.brush_size})
+                self._preview_style = style
+            return
+
+        if self._preview_item is not None:
+            self.canvas.delete(self._preview_item)
+        self._preview_item = self._shape_create[self.draw_mode](
+            self._last_x, self._last_y, x, y,
+            **{color_key: color, "width": self.brush_size}
+        )
+        self._preview_kind = self.draw_mode
+        self._preview_style = style
 
     def _end_draw(self, event: tk.Event) -> None:
+        self._flush_stroke()
+        self._latest_xy = None
+        item_ids: List[int] = []
+        if self.draw_mode == "pen" and self._pending_points:
+            if self._pending_line_id is None:
+                # A click without movement still leaves a dot
+                x, y = self._pending_points[0], self._pending_points[1]
+                self._pending_points.extend((x + 1, y + 1))
+            else:
+                item_ids.append(self._pending_line_id)
+                item_ids.extend(self._frozen_line_ids)
+            # Record the same points that were shown live (the spline with NumPy,
+            # the raw polyline without) so the backing image matches the screen
+            coords = _catmull_rom(self._pending_points) if _NUMPY_AVAILABLE else self._pending_points
+            self._current_stroke_spec.append(("create_line", tuple(coords), self._stroke_kwargs))
+        self._pending_points = []
+        self._pending_line_id = None
+        self._frozen_line_ids = []
+
         if self.draw_mode != "pen" and self._last_x is not None and self._last_y is not None:
-            if self._preview_item:
-                self.canvas.delete(self._preview_item)
+            # Move the preview to the release point and record it as the final shape
+            self._update_preview(event.x, event.y)
+            if self._preview_item is not None and self._preview_style is not None:
+                color, width = self._preview_style
+                item_ids.append(self._preview_item)
+                self._current_stroke_spec.append((
+                    _SHAPE_METHODS[self.draw_mode],
+                    (self._last_x, self._last_y, event.x, event.y),
+                    {_SHAPE_COLOR_OPTION[self.draw_mode]: color, "width": width,
+                     "tags": (self.current_stroke_tag,)},
+                ))
                 self._preview_item = None
-            
-            color = self.background_color if self.is_eraser else self.current_color
-            if self.draw_mode == "line":
-                self.canvas.create_line(
-                    self._last_x, self._last_y, event.x, event.y,
-                    fill=color, width=self.brush_size, tags=(self.current_stroke_tag,)
-                )
-            elif self.draw_mode == "rectangle":
-                self.canvas.create_rectangle(
-                    self._last_x, self._last_y, event.x, event.y,
-                    outline=color, width=self.brush_size, tags=(self.current_stroke_tag,)
-                )
-            elif self.draw_mode == "circle":
-                self.canvas.create_oval(
-                    self._last_x, self._last_y, event.x, event.y,
-                    outline=color, width=self.brush_size, tags=(self.current_stroke_tag,)
-                )
-            self._current_stroke_has_items = True
-        
-        if self._current_stroke_has_items and self.current_stroke_tag:
-            self.undo_stack.append(self.current_stroke_tag)
+                self._preview_kind = None
+
+        if self._current_stroke_spec and self.current_stroke_tag:
+            self._commit_stroke((self.current_stroke_tag, self._current_stroke_spec))
             self.redo_stack.clear()
-        self._current_stroke_has_items = False
+        for item_id in item_ids:
+            self.canvas.delete(item_id)
+        self._current_stroke_spec = []
         self.current_stroke_tag = None
         self._last_x, self._last_y = None, None
 
+    # --- Backing image ---
+    def _rasterize_stroke(self, spec: List[ItemSpec]) -> None:
+        """Draws a stroke's recorded create_* calls into the backing image."""
+        draw = self._backing_draw
+        for method, coords, kwargs in spec:
+            width = int(kwargs.get("width", 1))
+            if method == "create_line":
+                color = kwargs.get("fill")
+                points = list(zip(coords[0::2], coords[1::2]))
+                draw.line(points, fill=color, width=width, joint="curve")
+                if kwargs.get("capstyle") == tk.ROUND and width > 2:
+                    r = width / 2
+                    for x, y in (points[0], points[-1]):
+                        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+                continue
+
+            # Tk centres an outline on the box while PIL draws it inside the box,
+            # so grow the box by half the width to match what was on screen
+            x0, y0, x1, y1 = coords
+            half = width // 2
+            box = (min(x0, x1) - half, min(y0, y1) - half, max(x0, x1) + half, max(y0, y1) + half)
+            if method == "create_rectangle":
+                draw.rectangle(box, outline=kwargs.get("outline"), width=width)
+            elif method == "create_oval":
+                draw.ellipse(box, outline=kwargs.get("outline"), width=width)
+
+    def _stroke_bbox(self, spec: List[ItemSpec]) -> Box:
+        """Returns the backing-image box a stroke can touch, padded for line width."""
+        xs: List[float] = []
+        ys: List[float] = []
+        pad = 0
+        for _, coords, kwargs in spec:
+            xs.extend(coords[0::2])
+            ys.extend(coords[1::2])
+            pad = max(pad, int(kwargs.get("width", 1)))
+        pad += 2
+        w, h = self._backing.size
+        left = min(w, max(0, int(min(xs)) - pad))
+        top = min(h, max(0, int(min(ys)) - pad))
+        right = max(left, min(w, int(max(xs)) + pad + 1))
+        bottom = max(top, min(h, int(max(ys)) + pad + 1))
+        return left, top, right, bottom
+
+    def _commit_stroke(self, record: StrokeRecord) -> None:
+        """Rasterizes a stroke into the backing image and pushes it on the undo stack."""
+        spec = record[1]
+        box = self._stroke_bbox(spec)
+        before = self._backing.crop(box)
+        self._rasterize_stroke(spec)
+        self._refresh_backing(box)
+        self.undo_stack.append((record, box, before))
+        self._undo_crop_bytes += self._crop_size(before)
+        while self._undo_crop_bytes > _UNDO_CROP_BUDGET:
+            old_record, old_box, old_before = self.undo_stack[self._undo_cropless]
+            self._undo_crop_bytes -= self._crop_size(old_before)
+            self.undo_stack[self._undo_cropless] = (old_record, old_box, None)
+            self._undo_cropless += 1
+
+    @staticmethod
+    def _crop_size(crop: Optional[Image.Image]) -> int:
+        if crop is None:
+            return 0
+        return crop.width * crop.height * len(crop.getbands())
+
+    def _redraw_backing(self) -> None:
+        """Rebuilds the backing image from the strokes still on the undo stack."""
+        self._backing_draw.rectangle((0, 0) + self._backing.size, fill=self.background_color)
+        for (_, spec), _, _ in self.undo_stack:
+            self._rasterize_stroke(spec)
+        self._refresh_backing()
+
+    def _refresh_backing(self, box: Optional[Box] = None) -> None:
+        """Shows the backing image on the canvas; with a box, only that region."""
+        if box is None:
+            self._backing_photo.paste(self._backing)
+            return
+        left, top, right, bottom = box
+        if right <= left or bottom <= top:
+            return
+        # Copy just the changed pixels into the on-screen photo, so the cost
+        # follows the stroke's area rather than the whole image
+        patch = ImageTk.PhotoImage(self._backing.crop(box))
+        self.tk.call(self._backing_photo, "copy", patch, "-to", left, top, "-compositingrule", "set")
+
+    def _on_canvas_resize(self, event: tk.Event) -> None:
+        """Grows the backing image so it always covers the whole canvas."""
+        old_w, old_h = self._backing.size
+        if event.width <= old_w and event.height <= old_h:
+            return
+        # Existing pixels keep their position, so undo boxes stay valid
+        backing = Image.new("RGB", (max(old_w, event.width), max(old_h, event.height)), self.background_color)
+        backing.paste(self._backing, (0, 0))
+        self._backing = backing
+        self._backing_draw = ImageDraw.Draw(backing)
+        self._backing_photo = ImageTk.PhotoImage(backing)
+        self.canvas.itemconfigure(self._bg_item, image=self._backing_photo)
+
     # --- Editing actions ---
     def undo(self) -> None:
         if not self.undo_stack:
             return
-        stroke_tag = self.undo_stack.pop()
-        self.canvas.itemconfigure(stroke_tag, state='hidden')
-        self.redo_stack.append(stroke_tag)
+        record, box, before = self.undo_stack.pop()
+        if before is None:
+            self._undo_cropless = len(self.undo_stack)
+            self._redraw_backing()
+        else:
+            self._undo_crop_bytes -= self._crop_size(before)
+            self._backing.paste(before, box[:2])
+            self._refresh_backing(box)
+        self.redo_stack.append(record)
 
     def redo(self) -> None:
         if not self.redo_stack:
             return
-        stroke_tag = self.redo_stack.pop()
-        self.canvas.itemconfigure(stroke_tag, state='normal')
-        self.undo_stack.append(stroke_tag)
+        self._commit_stroke(self.redo_stack.pop())
 
     def clear_canvas(self) -> None:
-        self.canvas.delete("all")
         self.undo_stack.clear()
         self.redo_stack.clear()
+        self._undo_crop_bytes = 0
+        self._undo_cropless = 0
+        self._backing_draw.rectangle((0, 0) + self._backing.size, fill=self.background_color)
+        self._refresh_backing()
 
     def save_png(self) -> None:
         # Ask for path
@@ -264,46 +680,37 @@ class WhiteboardApp(tk.Tk):
         if not file_path:
             return
 
-        # Ensure window is updated so geometry is correct
-        self.update_idletasks()
-
-        # Compute screen bbox of the canvas and screenshot it
-        x = self.canvas.winfo_rootx()
-        y = self.canvas.winfo_rooty()
-        w = self.canvas.winfo_width()
-        h = self.canvas.winfo_height()
-        bbox = (x, y, x + w, y + h)
         try:
-            img = ImageGrab.grab(bbox=bbox)
-            img.save(file_path, "PNG")
+            self._capture_canvas_image().save(file_path, "PNG")
         except Exception as exc:  # noqa: BLE001
             messagebox.showerror("Save failed", f"Could not save image.\n{exc}")
 
-    def _capture_canvas_image(self) -> 'ImageGrab.Image':  # type: ignore[name-defined]
-        self.update_idletasks()
-        x = self.canvas.winfo_rootx()
-        y = self.canvas.winfo_rooty()
-        w = self.canvas.winfo_width()
-        h = self.canvas.winfo_height()
-        bbox = (x, y, x + w, y + h)
-        return ImageGrab.grab(bbox=bbox)
+    def _capture_canvas_image(self) -> Image.Image:
+        """Returns a copy of the drawing cropped to the visible canvas area."""
+        w = min(self.canvas.winfo_width(), self._backing.width)
+        h = min(self.canvas.winfo_height(), self._backing.height)
+        return self._backing.crop((0, 0, w, h))
     
     def analyze_drawing(self) -> None:
-        """Captures the canvas and analyzes it with a configured AI service."""
+        """Captures the canvas and queues it for analysis with a configured AI service."""
         try:
             img = self._capture_canvas_image()
         except Exception as exc:  # noqa: BLE001
             messagebox.showerror("Capture failed", f"Could not capture canvas.\n{exc}")
             return
         
-        gemini_key = os.environ.get("GEMINI_API_KEY")
-        if gemini_key and _GEMINI_AVAILABLE:
-            self._run_analysis_in_thread(self._analyze_with_gemini, img)
+        if self._gemini_model is not None:
+            # Vision models downsample internally; don't pay to encode/upload more
+            img.thumbnail(_AI_MAX_IMAGE_SIZE, Image.Resampling.BILINEAR)
+            self._queue_analysis("gemini", self._gemini_model_name, img)
             return
         
         hf_token = os.environ.get("HF_API_TOKEN")
         if hf_token:
-            self._run_analysis_in_thread(self._analyze_with_hf, img)
+            # The default ViT classifier takes a fixed 224x224 input
+            img = img.resize(_HF_INPUT_SIZE, Image.Resampling.BILINEAR)
+            model_name = os.environ.get("HF_MODEL", "google/vit-base-patch16-224")
+            self._queue_analysis("hf", model_name, img)
             return
         
         messagebox.showinfo(
@@ -311,79 +718,214 @@ class WhiteboardApp(tk.Tk):
             "Set GEMINI_API_KEY (Google Gemini) or HF_API_TOKEN (Hugging Face) and install dependencies to enable AI analysis.",
         )
 
-    def _run_analysis_in_thread(self, analysis_func, image) -> None:
-        """Runs the provided analysis function in a background thread to avoid UI blocking."""
+    def _queue_analysis(self, provider: str, model_name: str, img: Image.Image) -> None:
+        """Answers from the cache, or queues the image for the next batched request."""
+        cache_key = self._analysis_cache_key(provider, model_name, img)
+        if self._show_cached_analysis(cache_key):
+            return
+        self._analysis_queue.append((cache_key, img))
+        if not self._analysis_flush_scheduled:
+            self._analysis_flush_scheduled = True
+            self.after(_ANALYSIS_BATCH_WINDOW_MS, self._flush_analysis_queue)
+
+    def _flush_analysis_queue(self) -> None:
+        """Sends the analyses queued during the batch window, one request per model."""
+        self._analysis_flush_scheduled = False
+        batches: Dict[Tuple[str, str], Dict[AnalysisCacheKey, Image.Image]] = {}
+        for cache_key, img in self._analysis_queue:
+            provider, model_name, _ = cache_key
+            # Identical images within the window are only sent once
+            batches.setdefault((provider, model_name), {})[cache_key] = img
+        self._analysis_queue.clear()
+
+        for (provider, model_name), images in batches.items():
+            cache_keys = list(images)
+            if provider == "gemini":
+                coro = self._analyze_with_gemini(list(images.values()))
+            else:
+                # The HF inference endpoint takes one image per request; send them
+                # concurrently over the shared keep-alive session instead
+                coro = self._gather_analyses(
+                    [self._analyze_with_hf(img, model_name) for img in images.values()]
+                )
+            self._run_analysis(coro, cache_keys)
+
+    @staticmethod
+    async def _gather_analyses(coros: List[Coroutine[Any, Any, AnalysisResult]]) -> List[AnalysisResult]:
+        return list(await asyncio.gather(*coros))
+
+    def _encode_image(self, img: Image.Image, fmt: str) -> bytes:
+        """Encodes the image as PNG or JPEG for upload, favouring speed over size."""
+        # Encodes run on executor threads and share one reusable buffer
+        with self._encode_lock:
+            buf = self._encode_buf
+            buf.seek(0)
+            buf.truncate()
+            if fmt == "JPEG":
+                img.convert("RGB").save(buf, format="JPEG", quality=85)
+            else:
+                img.save(buf, format="PNG", optimize=False, compress_level=1)
+            with buf.getbuffer() as view:
+                return bytes(view[:buf.tell()])
+
+    @staticmethod
+    def _analysis_cache_key(provider: str, model_name: str, img: Image.Image) -> AnalysisCacheKey:
+        """Keys an analysis by provider, model and a digest of the exact pixels sent."""
+        digest = hashlib.blake2b(img.tobytes(), digest_size=16).digest()
+        return provider, model_name, digest
+
+    def _show_cached_analysis(self, cache_key: AnalysisCacheKey) -> bool:
+        """Shows a previous result for the same image and model; returns False on a miss."""
+        message = self._analysis_cache.get(cache_key)
+        if message is None:
+            return False
+        self._analysis_cache.move_to_end(cache_key)
+        messagebox.showinfo("AI Analysis", message)
+        return True
+
+    def _store_analysis(self, cache_key: AnalysisCacheKey, message: str) -> None:
+        self._analysis_cache[cache_key] = message
+        self._analysis_cache.move_to_end(cache_key)
+        while len(self._analysis_cache) > _ANALYSIS_CACHE_SIZE:
+            self._analysis_cache.popitem(last=False)
+
+    def _show_analyses(self, cache_keys: List[AnalysisCacheKey], results: List[AnalysisResult]) -> None:
+        for cache_key, (message, parsed) in zip(cache_keys, results):
+            if parsed:
+                self._store_analysis(cache_key, message)
+        messages = [message for message, _ in results]
+        if len(messages) == 1:
+            messagebox.showinfo("AI Analysis", messages[0])
+        else:
+            messagebox.showinfo("AI Analysis", "\n\n".join(
+                f"Drawing {i}:\n{message}" for i, message in enumerate(messages, 1)
+            ))
+
+    def _run_analysis(self, coro: Coroutine[Any, Any, List[AnalysisResult]], cache_keys: List[AnalysisCacheKey]) -> None:
+        """Schedules an analysis coroutine on the background loop to avoid UI blocking."""
+        self._pending_analyses += 1
         self.config(cursor="watch")
         self.update_idletasks()
 
-        def task_wrapper():
+        def on_done(future: "concurrent.futures.Future[List[AnalysisResult]]") -> None:
+            # Runs on the loop thread; hop back to Tk before touching widgets
             try:
-                message = analysis_func(image)
-                self.after(0, lambda: messagebox.showinfo("AI Analysis", message))
+                results = future.result()
+                self.after(0, lambda: self._show_analyses(cache_keys, results))
             except Exception as e:  # noqa: BLE001
-                self.after(0, lambda: messagebox.showerror("AI Error", str(e)))
+                # `e` is unbound once the except block ends; capture its text now
+                error_text = str(e)
+                self.after(0, lambda: messagebox.showerror("AI Error", error_text))
             finally:
-                self.after(0, lambda: self.config(cursor=""))
+                self.after(0, self._finish_analysis)
 
-        threading.Thread(target=task_wrapper, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(coro, self._loop).add_done_callback(on_done)
 
-    def _analyze_with_gemini(self, img: 'ImageGrab.Image') -> str:
-        """Analyzes the image with Google Gemini and returns a message string."""
-        gemini_key = os.environ.get("GEMINI_API_KEY")
-        with io.BytesIO() as buf:
-            img.save(buf, format="PNG")
-            image_bytes = buf.getvalue()
-
-        genai.configure(api_key=gemini_key)
-        model_name = os.environ.get("GEMINI_MODEL", "gemini-1.5-flash")
-        model = genai.GenerativeModel(model_name)
-        prompt = (
-            "You are a drawing judge. Look at the sketch and provide: "
-            "1) a short label for what it depicts, 2) a confidence 0-100, "
-            "3) a one-sentence critique or suggestion. Respond in JSON with keys: "
-            "label, confidence, critique."
-        )
-        image_part = {"mime_type": "image/png", "data": image_bytes}
-        resp = model.generate_content([prompt, image_part])
-        content = getattr(resp, "text", None) or (resp.candidates[0].content.parts[0].text if getattr(resp, "candidates", None) else "")
+    def _finish_analysis(self) -> None:
+        self._pending_analyses -= 1
+        if self._pending_analyses == 0:
+            self.config(cursor="")
 
+    async def _warm_up_gemini(self) -> None:
+        """Makes a free token-count call so the async client connects ahead of use."""
+        try:
+            await self._gemini_model.count_tokens_async("ping")
+        except Exception:  # noqa: BLE001
+            # Only a warm-up; a real failure will surface on the first analysis
+            pass
 
-        result = None
-        if content:
+    async def _analyze_with_gemini(self, imgs: List[Image.Image]) -> List[AnalysisResult]:
+        """Analyzes one or more images with a single Google Gemini request.
+
+        Returns one (message, parsed) pair per image, in order.
+        """
+        async with self._analysis_semaphore:
+            loop = asyncio.get_running_loop()
+            image_parts = []
+            for img in imgs:
+                image_bytes = await loop.run_in_executor(None, self._encode_image, img, "PNG")
+                image_parts.append({"mime_type": "image/png", "data": image_bytes})
+
+            prompt = (
+                "You are a drawing judge. Look at the sketch and provide: "
+                "1) a short label for what it depicts, 2) a confidence 0-100, "
+                "3) a one-sentence critique or suggestion. Respond in JSON with keys: "
+                "label, confidence, critique."
+            )
+            if len(imgs) > 1:
+                prompt += (
+                    f" You are given {len(imgs)} sketches; judge each one separately and "
+                    f"respond with {len(imgs)} JSON objects, one per sketch, in the order given."
+                )
+            for attempt in range(_GEMINI_MAX_ATTEMPTS):
+                try:
+                    resp = await self._gemini_model.generate_content_async([prompt, *image_parts], stream=True)
+                    content, results = await self._read_gemini_stream(resp, len(imgs))
+                    break
+                except google_exceptions.ResourceExhausted:
+                    if attempt == _GEMINI_MAX_ATTEMPTS - 1:
+                        raise
+                    await asyncio.sleep(_GEMINI_BACKOFF_SECONDS * 2 ** attempt)
+
+        analyses: List[AnalysisResult] = []
+        for i in range(len(imgs)):
+            result = results[i] if i < len(results) else {}
+            if "label" in result and "confidence" in result:
+                label, conf = result["label"], result["confidence"]
+                critique = result.get("critique", "")
+                analyses.append((f"Label: {label}\nConfidence: {conf}\n\n{critique}", True))
+            else:
+                # Not a judgement (e.g. an {"error": ...} object); show the raw reply
+                analyses.append((content or "No response", False))
+        return analyses
+
+    @staticmethod
+    async def _read_gemini_stream(resp, count: int) -> Tuple[str, List[dict]]:
+        """Reads a streamed Gemini response until `count` JSON objects have parsed.
+
+        Returns the text received so far and the parsed objects, which may be
+        fewer than `count` if the response ended first.
+        """
+        parts: List[str] = []
+        results: List[dict] = []
+        scanner = _JsonObjectScanner()
+        async for chunk in resp:
             try:
-                result = json.loads(content)
-            except json.JSONDecodeError:
-                match = re.search(r"\{[\s\S]*\}", content)
-                if match:
-                    try:
-                        result = json.loads(match.group(0))
-                    except json.JSONDecodeError:
-                        result = None
-        if isinstance(result, dict):
-            label = result.get("label", "Unknown")
-            conf = result.get("confidence", "?")
-            critique = result.get("critique", "")
-            return f"Label: {label}\nConfidence: {conf}\n\n{critique}"
-        else:
-            return content or "No response"
-
-    def _analyze_with_hf(self, img: 'ImageGrab.Image') -> str:
-        """Analyzes the image with Hugging Face and returns a message string."""
+                text = chunk.text
+            except ValueError:
+                # Chunk without text parts (e.g. a safety block)
+                continue
+            parts.append(text)
+            for candidate in scanner.feed(text):
+                try:
+                    result = json.loads(candidate)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(result, dict):
+                    results.append(result)
+                    if len(results) == count:
+                        return "".join(parts), results
+        return "".join(parts), results
+
+    async def _analyze_with_hf(self, img: Image.Image, model_name: str) -> AnalysisResult:
+        """Analyzes the image with Hugging Face and returns a (message, parsed) pair."""
         hf_token = os.environ.get("HF_API_TOKEN")
         if not hf_token:
-            return "HF_API_TOKEN not configured"
-        
-        with io.BytesIO() as buf:
-            img.save(buf, format="PNG")
-            image_bytes = buf.getvalue()
-
-        model = os.environ.get("HF_MODEL", "google/vit-base-patch16-224")
-        url = f"https://api-inference.huggingface.co/models/{model}"
-        headers = {"Authorization": f"Bearer {hf_token}"}
-        resp = requests.post(url, headers=headers, data=image_bytes, timeout=60)
-        
+            return "HF_API_TOKEN not configured", False
+
+        async with self._analysis_semaphore:
+            loop = asyncio.get_running_loop()
+            image_bytes = await loop.run_in_executor(None, self._encode_image, img, "JPEG")
+
+            url = f"https://api-inference.huggingface.co/models/{model_name}"
+            headers = {"Authorization": f"Bearer {hf_token}", "Content-Type": "image/jpeg"}
+            # The session (with its retry adapter) is blocking; keep it off the loop
+            resp = await loop.run_in_executor(None, functools.partial(
+                self._hf_session.post, url, headers=headers, data=image_bytes, timeout=60
+            ))
+
         if resp.status_code == 503:
-            return "Model is loading on Hugging Face. Please try again in a few seconds."
+            return _HF_LOADING_MESSAGE, False
         
         resp.raise_for_status()
         data = resp.json()
@@ -392,9 +934,9 @@ class WhiteboardApp(tk.Tk):
             top = max(data, key=lambda x: x.get("score", 0))
             label = top.get("label", "Unknown")
             conf = round(float(top.get("score", 0)) * 100, 1)
-            return f"Label: {label}\nConfidence: {conf}"
+            return f"Label: {label}\nConfidence: {conf}", True
         else:
-            return str(data)
+            return str(data), False
 
 
 def main() -> None: